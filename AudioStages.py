@@ -0,0 +1,349 @@
+import gzip
+import math
+import multiprocessing
+import operator
+import os
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+try:
+    from multiprocessing import shared_memory  # Python 3.8 or later
+except ImportError:
+    shared_memory = None
+
+
+SAMPLE_WIDTH = 2  # Only 16-bit PCM (pyaudio.paInt16) is supported
+RESAMPLE_ZERO_CROSSINGS = 8  # Half-width of the windowed-sinc resampling kernel, in zero crossings
+
+
+class SharedAudioBuffer:
+    def __init__(self, size, data=None):
+        """
+        Allocate a shared memory block that worker processes attach to by name.
+        :param size: The size of the block in bytes.
+        :param data: Optional data to copy into the block.
+        """
+        self.size = size
+        # Zero-sized blocks are not allowed
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        if data is not None:
+            self.shm.buf[:len(data)] = data
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def read(self, start=0, end=None):
+        """
+        Copy a range of the block out as bytes.
+        """
+        return bytes(self.shm.buf[start:self.size if end is None else end])
+
+    def close(self):
+        """
+        Release and remove the shared memory block.
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Worker stages: they run in the pool processes and only exchange shared memory names and offsets
+
+def resample_kernels(src_rate, dst_rate):
+    """
+    Precompute the windowed-sinc resampling kernel for every fractional phase. For integer rates the
+    output positions only fall on dst_rate / gcd(src_rate, dst_rate) distinct phases, so the kernels repeat.
+    When downsampling, the cutoff is the target Nyquist frequency, so the signal is low-pass filtered
+    before decimation and does not alias.
+    :return: The phase count, the source step per output frame in phases, the first tap offset and the
+        list of normalized weights per phase.
+    """
+    divisor = math.gcd(src_rate, dst_rate)
+    phases = dst_rate // divisor
+    step = src_rate // divisor
+    cutoff = min(1.0, dst_rate / src_rate)
+    half_width = RESAMPLE_ZERO_CROSSINGS / cutoff
+    first = -int(math.floor(half_width))
+    kernels = []
+    for phase in range(phases):
+        frac = phase / phases
+        weights = []
+        for offset in range(first, int(math.ceil(half_width)) + 1):
+            t = frac - offset
+            if abs(t) >= half_width:
+                weights.append(0.0)
+                continue
+            x = math.pi * cutoff * t
+            sinc = math.sin(x) / x if x else 1.0
+            weights.append(sinc * (0.5 + 0.5 * math.cos(math.pi * t / half_width)))  # Hann window
+        # Normalize for unity DC gain
+        total = sum(weights)
+        kernels.append([weight / total for weight in weights])
+    return phases, step, first, kernels
+
+
+def _resample_stage(in_name, in_frames, out_name, start, end, src_rate, dst_rate, channels):
+    """
+    Resample output frames [start, end) of 16-bit PCM into the output block with precomputed
+    windowed-sinc kernels. Samples beyond the edges repeat the first and last frame.
+    """
+    src = shared_memory.SharedMemory(name=in_name)
+    dst = shared_memory.SharedMemory(name=out_name)
+    samples = out = None
+    try:
+        samples = src.buf.cast("h")
+        out = dst.buf.cast("h")
+        phases, step, first, kernels = resample_kernels(src_rate, dst_rate)
+        taps = len(kernels[0])
+        last = in_frames - 1
+        for j in range(start, end):
+            i, phase = divmod(j * step, phases)
+            weights = kernels[phase]
+            lo = i + first
+            hi = lo + taps
+            for c in range(channels):
+                if lo >= 0 and hi <= in_frames:
+                    # Dot product in C over a strided view of one channel
+                    window = samples[lo * channels + c:hi * channels:channels]
+                    acc = sum(map(operator.mul, window, weights))
+                    window.release()
+                else:
+                    acc = sum(samples[min(last, max(0, k)) * channels + c] * weight
+                              for k, weight in zip(range(lo, hi), weights))
+                out[j * channels + c] = max(-32768, min(32767, int(round(acc))))
+    finally:
+        if samples is not None:
+            samples.release()
+        if out is not None:
+            out.release()
+        src.close()
+        dst.close()
+
+
+def _energy_stage(in_name, out_name, start, end, frame_samples):
+    """
+    Compute the RMS energy of frames [start, end) into the output block as doubles.
+    """
+    src = shared_memory.SharedMemory(name=in_name)
+    dst = shared_memory.SharedMemory(name=out_name)
+    samples = out = None
+    try:
+        samples = src.buf.cast("h")
+        out = dst.buf.cast("d")
+        total = len(samples)
+        for f in range(start, end):
+            offset = f * frame_samples
+            with samples[offset:min(offset + frame_samples, total)] as frame:
+                out[f] = math.sqrt(sum(s * s for s in frame) / len(frame)) if len(frame) else 0.0
+    finally:
+        if samples is not None:
+            samples.release()
+        if out is not None:
+            out.release()
+        src.close()
+        dst.close()
+
+
+def _compress_stage(in_name, offset, size, out_name, out_offset, out_size):
+    """
+    Gzip one chunk of the input block into its slot of the output block.
+    :return: The compressed size.
+    """
+    src = shared_memory.SharedMemory(name=in_name)
+    dst = shared_memory.SharedMemory(name=out_name)
+    try:
+        payload = gzip.compress(src.buf[offset:offset + size])
+        if len(payload) > out_size:
+            raise ValueError("Compressed chunk does not fit its output slot")
+        dst.buf[out_offset:out_offset + len(payload)] = payload
+        return len(payload)
+    finally:
+        src.close()
+        dst.close()
+
+
+def gzip_bound(size):
+    """
+    Get the largest possible gzip output size for an input of the given size.
+    """
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 13 + 18
+
+
+def split_range(total, parts):
+    """
+    Split range(total) into at most parts contiguous (start, end) pieces.
+    """
+    parts = max(1, min(parts, total))
+    step = -(-total // parts) if total else 0
+    return [(start, min(start + step, total)) for start in range(0, total, step)] if total else []
+
+
+class CpuStagePool:
+    def __init__(self, processes=None):
+        """
+        Run CPU-heavy audio stages in a process pool, exchanging audio through shared memory instead of pickled bytes.
+        The pool can be shared by several recording threads.
+
+        :param processes: The number of worker processes. Default is the number of CPUs.
+        """
+        if shared_memory is None:
+            raise RuntimeError("CpuStagePool requires Python 3.8 or later (multiprocessing.shared_memory)")
+        self.processes = processes or os.cpu_count() or 1
+        # Workers start lazily from recording threads, when pynput and PortAudio threads are already running;
+        # forking a multi-threaded process can deadlock the child, so spawn fresh interpreters instead
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    def resample(self, pcm, src_rate, dst_rate, channels=1):
+        """
+        Resample 16-bit PCM audio with a windowed-sinc kernel (low-pass filtered when downsampling).
+        :param pcm: The PCM data.
+        :param src_rate: The source sample rate.
+        :param dst_rate: The target sample rate.
+        :param channels: The number of interleaved channels.
+        :return: The resampled PCM data.
+        """
+        in_frames = len(pcm) // (SAMPLE_WIDTH * channels)
+        if src_rate == dst_rate or in_frames == 0:
+            return bytes(pcm)
+        out_frames = in_frames * dst_rate // src_rate
+        with SharedAudioBuffer(len(pcm), pcm) as src, \
+                SharedAudioBuffer(out_frames * channels * SAMPLE_WIDTH) as dst:
+            futures = [
+                self.executor.submit(_resample_stage, src.name, in_frames, dst.name, start, end,
+                                     src_rate, dst_rate, channels)
+                for start, end in split_range(out_frames, self.processes)
+            ]
+            for future in futures:
+                future.result()
+            return dst.read()
+
+    def frame_energy(self, pcm, rate, channels=1, frame_ms=30):
+        """
+        Compute the RMS energy of each frame of 16-bit PCM audio.
+        :param pcm: The PCM data.
+        :param rate: The sample rate.
+        :param channels: The number of interleaved channels.
+        :param frame_ms: The frame length in milliseconds.
+        :return: The list of frame energies.
+        """
+        frame_samples = max(1, rate * frame_ms // 1000) * channels
+        total_samples = len(pcm) // SAMPLE_WIDTH
+        frames = -(-total_samples // frame_samples)
+        if frames == 0:
+            return []
+        with SharedAudioBuffer(len(pcm), pcm) as src, SharedAudioBuffer(frames * 8) as dst:
+            futures = [
+                self.executor.submit(_energy_stage, src.name, dst.name, start, end, frame_samples)
+                for start, end in split_range(frames, self.processes)
+            ]
+            for future in futures:
+                future.result()
+            return list(dst.shm.buf[:frames * 8].cast("d"))
+
+    def trim_silence(self, pcm, rate, channels=1, frame_ms=30, threshold=500, padding_ms=200):
+        """
+        Energy-based VAD: cut leading and trailing silence from 16-bit PCM audio.
+        :param pcm: The PCM data.
+        :param rate: The sample rate.
+        :param channels: The number of interleaved channels.
+        :param frame_ms: The frame length in milliseconds.
+        :param threshold: The RMS energy above which a frame counts as speech.
+        :param padding_ms: The silence kept around the speech in milliseconds.
+        :return: The trimmed PCM data, or the original data if no speech was detected.
+        """
+        energies = self.frame_energy(pcm, rate, channels, frame_ms)
+        voiced = [i for i, energy in enumerate(energies) if energy >= threshold]
+        if not voiced:
+            return bytes(pcm)
+        frame_bytes = max(1, rate * frame_ms // 1000) * channels * SAMPLE_WIDTH
+        padding = rate * padding_ms // 1000 * channels * SAMPLE_WIDTH
+        start = max(0, voiced[0] * frame_bytes - padding)
+        end = min(len(pcm), (voiced[-1] + 1) * frame_bytes + padding)
+        return bytes(pcm[start:end])
+
+    def compress_chunks(self, data, chunk_size):
+        """
+        Gzip the data in chunks, sliced the same way as AsrWsClient.slice_data, in parallel.
+        :param data: The data to compress.
+        :param chunk_size: The chunk size.
+        :return: The list of compressed chunks.
+        """
+        ranges = []
+        offset = 0
+        while offset + chunk_size < len(data):
+            ranges.append((offset, chunk_size))
+            offset += chunk_size
+        ranges.append((offset, len(data) - offset))
+        slots = []
+        out_offset = 0
+        for _, size in ranges:
+            slots.append((out_offset, gzip_bound(size)))
+            out_offset += gzip_bound(size)
+        with SharedAudioBuffer(len(data), data) as src, SharedAudioBuffer(out_offset) as dst:
+            futures = [
+                self.executor.submit(_compress_stage, src.name, offset, size, dst.name, slot_offset, slot_size)
+                for (offset, size), (slot_offset, slot_size) in zip(ranges, slots)
+            ]
+            return [
+                dst.read(slot_offset, slot_offset + future.result())
+                for future, (slot_offset, _) in zip(futures, slots)
+            ]
+
+    def prepare_wav(self, data, rate=None, trim=True):
+        """
+        Prepare a recorded WAV file for recognition: trim silence and optionally resample it.
+        :param data: The WAV file data.
+        :param rate: The target sample rate. Default keeps the recorded rate, the ASR workflow resamples itself.
+            Resampling here costs about 0.2 s of CPU per second of 48 kHz stereo audio, so it is not used on the live path.
+        :param trim: Whether to cut leading and trailing silence.
+        :return: The prepared WAV file data.
+        """
+        with BytesIO(data) as _f:
+            with wave.open(_f, 'rb') as wave_fp:
+                channels, sampwidth, framerate, nframes = wave_fp.getparams()[:4]
+                pcm = wave_fp.readframes(nframes)
+        if sampwidth != SAMPLE_WIDTH:
+            raise ValueError("Only 16-bit WAV audio is supported")
+        if trim:
+            pcm = self.trim_silence(pcm, framerate, channels)
+        if rate is None:
+            rate = framerate
+        pcm = self.resample(pcm, framerate, rate, channels)
+        with BytesIO() as _f:
+            with wave.open(_f, 'wb') as wf:
+                wf.setnchannels(channels)
+                wf.setsampwidth(sampwidth)
+                wf.setframerate(rate)
+                wf.writeframes(pcm)
+            return _f.getvalue()
+
+    def close(self):
+        """
+        Shut down the worker processes.
+        """
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    with open("start.wav", "rb") as f:
+        wav_data = f.read()
+
+    with CpuStagePool() as pool:
+        prepared = pool.prepare_wav(wav_data)
+        chunks = pool.compress_chunks(prepared, 32000)
+        print(f"WAV {len(wav_data)} bytes -> prepared {len(prepared)} bytes -> "
+              f"{len(chunks)} compressed chunks, {sum(len(chunk) for chunk in chunks)} bytes")
@@ -0,0 +1,256 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from CommandDispatcher import MODE_TABLE, OP_SET, OP_ADD, OP_SUB, ControlCommand, parse_command
+
+
+# Number with an optional unit; ASR inverse text normalization already turns spoken numbers into digits
+SLOT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(厘米|公分|cm|毫米|mm|米|m|度|°)?")
+PUNCTUATION_PATTERN = re.compile(r"[\s，。！？、,.!?；;：:\"“”']+")
+FILLER_WORDS = ("请", "帮我", "给我", "一下", "把", "将", "机器人", "吧", "呢", "啊", "呀", "嘛")
+
+# Unit -> (dimension, factor to the command unit); lengths become meters and angles stay degrees as in Prompt.txt
+UNITS = {
+    "厘米": ("len", 0.01), "公分": ("len", 0.01), "cm": ("len", 0.01),
+    "毫米": ("len", 0.001), "mm": ("len", 0.001),
+    "米": ("len", 1.0), "m": ("len", 1.0),
+    "度": ("deg", 1.0), "°": ("deg", 1.0),
+    None: ("", 1.0),
+}
+
+# Operation words from Prompt.txt ("到/设置"→1, "加/增"→2, "减/降"→3), longest first
+OP_WORDS = [
+    ("设置成", OP_SET), ("设置为", OP_SET), ("设置到", OP_SET), ("调整到", OP_SET), ("调整为", OP_SET),
+    ("调到", OP_SET), ("调成", OP_SET), ("设为", OP_SET), ("设成", OP_SET), ("设置", OP_SET), ("到", OP_SET),
+    ("增加", OP_ADD), ("加", OP_ADD), ("增", OP_ADD),
+    ("减少", OP_SUB), ("降低", OP_SUB), ("减", OP_SUB), ("降", OP_SUB),
+]
+OP_SYMBOLS = {OP_SET: "=", OP_ADD: "+", OP_SUB: "-"}
+
+# Mode and sub mode names; a cached command is only reused for the same targets
+TARGET_WORDS = sorted(
+    set([name for name, _ in MODE_TABLE.values()] +
+        [sub_name for _, sub_modes in MODE_TABLE.values() for sub_name in sub_modes.values()]),
+    key=len, reverse=True
+)
+# Direction and axis words; "向前" and "向后" template almost identically but are opposite commands
+DIRECTION_WORDS = ("顺时针", "逆时针", "俯仰", "横滚", "偏航", "前", "后", "左", "右", "上", "下")
+# Template tokens: a slot marker such as "#len" counts as one token, everything else is one character
+TEMPLATE_TOKEN_PATTERN = re.compile(r"#[a-z]*|.")
+
+
+def to_template(transcript):
+    """
+    Turn a transcript into a template with the numbers and units pulled out as slots.
+    :param transcript: The recognized text.
+    :return: The template, the list of (value, unit) slots, the operation type and the set of target and
+        direction words, which must match exactly for a cached command to be reused.
+    """
+    slots = []
+
+    def replace_slot(match):
+        unit, factor = UNITS[match.group(2)]
+        slots.append((float(match.group(1)), unit, factor))
+        return "#" + unit
+
+    # Pull the numbers out before punctuation is stripped, so decimal points are kept
+    text = SLOT_PATTERN.sub(replace_slot, transcript.lower())
+    text = PUNCTUATION_PATTERN.sub("", text)
+    for word in FILLER_WORDS:
+        text = text.replace(word, "")
+    targets = set()
+    rest = text
+    for word in TARGET_WORDS:
+        if word in rest:
+            targets.add(word)
+            # Keep "后" in "后空翻" from counting as a direction
+            rest = rest.replace(word, " ")
+    for word in DIRECTION_WORDS:
+        if word in rest:
+            targets.add(word)
+            rest = rest.replace(word, " ")
+    targets = frozenset(targets)
+
+    op = None
+    for word, word_op in OP_WORDS:
+        if word in text:
+            op = word_op if op is None else op
+            text = text.replace(word, OP_SYMBOLS[word_op])
+    return text, slots, op or OP_SET, targets
+
+
+def ngram_vector(template, n=2):
+    """
+    Build the n-gram count vector of a template, with each slot marker as a single token
+    so that shared units do not inflate the similarity.
+    """
+    tokens = ["^"] + TEMPLATE_TOKEN_PATTERN.findall(template) + ["$"]
+    return Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+class CacheEntry:
+    __slots__ = ("template", "command", "slot_units", "literal_values", "op", "targets", "vector", "norm")
+
+    def __init__(self, template, command, slot_units, literal_values, op, targets):
+        self.template = template
+        self.command = command
+        self.slot_units = slot_units
+        self.literal_values = literal_values  # None if the value is filled from the slot
+        self.op = op
+        self.targets = targets
+        self.vector = ngram_vector(template)
+        self.norm = math.sqrt(sum(count * count for count in self.vector.values()))
+
+
+class CommandCache:
+    def __init__(self, threshold=0.75, max_entries=1000):
+        """
+        Cache LLM command results by transcript template, so commands that only differ in wording
+        or value are answered without an LLM call.
+
+        :param threshold: The minimum cosine similarity between n-gram vectors for a fuzzy hit.
+        :param max_entries: The maximum number of cached templates, least recently used are evicted.
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # template -> CacheEntry
+        self.index = {}  # n-gram -> set of templates
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.stores = 0
+        self.rejected = 0
+
+    def store(self, transcript, code):
+        """
+        Cache the command the LLM returned for a transcript.
+        :param transcript: The recognized text.
+        :param code: The command string returned by the LLM.
+        :return: True if the command was cached.
+        """
+        try:
+            command = parse_command(code)
+        except ValueError:
+            with self.lock:
+                self.rejected += 1
+            return False
+        template, slots, op, targets = to_template(transcript)
+        literal_values = None
+        if slots:
+            value, _, factor = slots[0]
+            if len(slots) != 1 or command.value is None or abs(round(value * factor, 2) - command.value) > 0.005:
+                # The value does not come from the slot by unit conversion, only reuse it for the same numbers
+                literal_values = tuple(slot[0] for slot in slots)
+        entry = CacheEntry(template, command, tuple(slot[1] for slot in slots), literal_values, op, targets)
+        with self.lock:
+            self._remove(template)
+            self.entries[template] = entry
+            for gram in entry.vector:
+                self.index.setdefault(gram, set()).add(template)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+            self.stores += 1
+        return True
+
+    def _remove(self, template):
+        entry = self.entries.pop(template, None)
+        if entry is None:
+            return
+        for gram in entry.vector:
+            templates = self.index.get(gram)
+            if templates is not None:
+                templates.discard(template)
+                if not templates:
+                    del self.index[gram]
+
+    def lookup(self, transcript):
+        """
+        Look up the command for a transcript, filling the new value into the cached command.
+        :param transcript: The recognized text.
+        :return: The command string, or None on a miss.
+        """
+        template, slots, op, targets = to_template(transcript)
+        slot_units = tuple(slot[1] for slot in slots)
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(template)
+            fuzzy = entry is None
+            if fuzzy:
+                entry = self._nearest(template, op, targets, slot_units)
+            if entry is None or (entry.literal_values is not None and
+                                 entry.literal_values != tuple(slot[0] for slot in slots)):
+                return None
+            self.entries.move_to_end(entry.template)
+            self.hits += 1
+            if fuzzy:
+                self.fuzzy_hits += 1
+        command = entry.command
+        if entry.literal_values is None and slots:
+            value, _, factor = slots[0]
+            command = ControlCommand(command.mode, command.sub_mode, command.op, round(value * factor, 2))
+        return command.to_code()
+
+    def _nearest(self, template, op, targets, slot_units):
+        vector = ngram_vector(template)
+        norm = math.sqrt(sum(count * count for count in vector.values()))
+        candidates = set()
+        for gram in vector:
+            candidates.update(self.index.get(gram, ()))
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            entry = self.entries[candidate]
+            if entry.op != op or entry.targets != targets or entry.slot_units != slot_units:
+                continue
+            dot = sum(count * entry.vector.get(gram, 0) for gram, count in vector.items())
+            score = dot / (norm * entry.norm)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        """
+        Get the cache metrics.
+        :return: A dict of the lookup, hit and store counts and the hit rate.
+        """
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "fuzzy_hits": self.fuzzy_hits,
+                "misses": self.lookups - self.hits,
+                "stores": self.stores,
+                "rejected": self.rejected,
+                "hit_rate": self.hit_rate,
+            }
+
+
+if __name__ == "__main__":
+    cache = CommandCache()
+    cache.store("步高调到15厘米", "1-3-1-0.15")
+    cache.store("步高加5厘米", "1-3-2-0.05")
+    for user_input in ["把步高设置成20厘米", "步高调到8厘米", "步高加3厘米", "步高减3厘米", "能不能后空翻"]:
+        print(f"{user_input} -> {cache.lookup(user_input)}")
+
+    # Opposite directions and axes never reuse each other's command
+    cache.store("向前移动10厘米", "1-1-1-0.10")
+    cache.store("向前走", "1-1-1--1")
+    cache.store("俯仰角加15度", "1-2-2-15.00")
+    for user_input in ["向后移动10厘米", "向左移动10厘米", "向右移动20厘米", "向后走", "向左走", "横滚角加15度"]:
+        assert cache.lookup(user_input) is None, user_input
+    assert cache.lookup("向前移动20厘米") == "1-1-1-0.20"
+
+    # Decimal values keep their point when stored and looked up
+    assert cache.lookup("步高调到1.5厘米") == "1-3-1-0.01"
+    assert cache.lookup("步高加0.5米") == "1-3-2-0.50"
+    cache.store("平移调到1.5厘米", "1-2-1-0.02")
+    assert cache.lookup("平移调到15厘米") is None
+    assert cache.lookup("平移调到1.5厘米。") == "1-2-1-0.02"
+    print(cache.stats())
@@ -0,0 +1,316 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+# Mode table from Prompt.txt: main mode -> (name, {sub mode -> name})
+MODE_TABLE = {
+    1: ("动态展示", {1: "进退", 2: "平移", 3: "步高"}),
+    2: ("循迹模式", {1: "对角小跑", 2: "遛蹄", 3: "步行", 4: "跳跃"}),
+    3: ("前空翻", {}),
+    # Not in the mode table, but the output rules list 4/5/6 as stunt actions returned as a single digit
+    4: ("特技动作", {}),
+    5: ("后空翻", {}),
+    6: ("跳跃", {}),
+    7: ("未定义", {}),
+}
+
+# The gait shortcut in Prompt.txt ("小跑/对角"→3-1, "疾走/快走"→3-3) reuses the
+# gait numbering of the tracking mode under main mode 3.
+GAIT_SHORTCUT_MODE = 3
+
+# Operation types
+OP_SET = 1
+OP_ADD = 2
+OP_SUB = 3
+
+MISSING = -1
+
+# Missing levels are filled with -1, e.g. "1--1-1-0.50"
+COMMAND_PATTERN = re.compile(r"(\d+)(?:-(-1|\d+))?(?:-(-1|\d+))?(?:-(-1|\d+(?:\.\d+)?))?")
+
+
+class ControlCommand:
+    """
+    A parsed robot command in the `main mode-sub mode-operation type-value` format.
+    Missing levels are stored as None.
+    """
+    __slots__ = ("mode", "sub_mode", "op", "value", "timestamp")
+
+    def __init__(self, mode, sub_mode=None, op=None, value=None, timestamp=None):
+        self.mode = mode
+        self.sub_mode = sub_mode
+        self.op = op
+        self.value = value
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+
+    @property
+    def target(self):
+        """
+        The (main mode, sub mode) pair the command acts on.
+        """
+        return self.mode, self.sub_mode
+
+    @property
+    def is_relative(self):
+        """
+        Whether the command is an increase/decrease adjustment.
+        """
+        return self.op in (OP_ADD, OP_SUB) and self.value is not None
+
+    @property
+    def is_absolute(self):
+        """
+        Whether the command sets the target to an absolute value.
+        """
+        return self.op == OP_SET and self.value is not None
+
+    def signed_value(self):
+        """
+        Get the value as a signed delta (decrease commands are negative).
+        """
+        return -self.value if self.op == OP_SUB else self.value
+
+    def to_code(self):
+        """
+        Encode the command back to the string format returned by the LLM.
+        :return: The command string, e.g. "1-3-2-0.05".
+        """
+        levels = [self.mode, self.sub_mode, self.op]
+        if self.value is not None:
+            levels.append(format_value(self.value))
+        while levels and levels[-1] is None:
+            levels.pop()
+        return "-".join(str(MISSING if level is None else level) for level in levels)
+
+    def __eq__(self, other):
+        if not isinstance(other, ControlCommand):
+            return NotImplemented
+        return self.to_code() == other.to_code()
+
+    def __hash__(self):
+        return hash(self.to_code())
+
+    def __repr__(self):
+        return f"ControlCommand({self.to_code()!r})"
+
+
+def format_value(value):
+    """
+    Format a value with 2 decimal places (0 is not padded).
+    :param value: The numeric value.
+    :return: The formatted value string.
+    """
+    if value == 0:
+        return "0"
+    return f"{value:.2f}"
+
+
+def _parse_level(part):
+    if part is None:
+        return None
+    level = int(part)
+    return None if level == MISSING else level
+
+
+def parse_command(text):
+    """
+    Parse and validate a command string returned by the LLM.
+    :param text: The command string, e.g. "1-2-2-15.00" or "5".
+    :return: The parsed ControlCommand.
+    :raises ValueError: If the string is malformed or does not match the mode table.
+    """
+    if text is None:
+        raise ValueError("Empty command")
+    match = COMMAND_PATTERN.fullmatch(text.strip().strip("`").strip())
+    if match is None:
+        raise ValueError(f"Malformed command: {text!r}")
+    mode = int(match.group(1))
+    sub_mode = _parse_level(match.group(2))
+    op = _parse_level(match.group(3))
+    value = None
+    if match.group(4) is not None and match.group(4) != str(MISSING):
+        value = float(match.group(4))
+
+    if mode not in MODE_TABLE:
+        raise ValueError(f"Unknown main mode {mode} in command {text!r}")
+    sub_modes = MODE_TABLE[mode][1]
+    if mode == GAIT_SHORTCUT_MODE:
+        sub_modes = MODE_TABLE[2][1]
+    if sub_mode is not None and sub_mode not in sub_modes:
+        raise ValueError(f"Unknown sub mode {sub_mode} for main mode {mode} in command {text!r}")
+    if op is not None and op not in (OP_SET, OP_ADD, OP_SUB):
+        raise ValueError(f"Unknown operation type {op} in command {text!r}")
+    if value is not None and op is None:
+        raise ValueError(f"Value without operation type in command {text!r}")
+    if op in (OP_ADD, OP_SUB) and value is not None and value < 0:
+        raise ValueError(f"Negative adjustment in command {text!r}")
+    return ControlCommand(mode, sub_mode, op, value)
+
+
+class CommandDispatchQueue:
+    def __init__(self, sender, min_interval=0.2):
+        """
+        Initialize the dispatch queue between the command encoder and the robot.
+        Pending commands are coalesced per target and sent at most once per min_interval per target.
+
+        :param sender: Callable that delivers one ControlCommand to the robot.
+        :param min_interval: The minimum interval in seconds between two commands sent to the same target.
+        """
+        self.sender = sender
+        self.min_interval = min_interval
+        self.pending = OrderedDict()  # target -> ControlCommand
+        self.last_sent = {}  # target -> monotonic time
+        self.merged_count = 0
+        self.dropped_count = 0
+        self.sent_count = 0
+        self.failed_count = 0
+        self.condition = threading.Condition()
+        self.worker = None
+        self.running = False
+
+    def put(self, command):
+        """
+        Add a command to the queue, merging it with the pending command for the same target.
+        :param command: A ControlCommand or a command string.
+        :return: The pending command for the target after coalescing, or None if the adjustments cancelled out.
+        """
+        if not isinstance(command, ControlCommand):
+            command = parse_command(command)
+        with self.condition:
+            target = command.target
+            previous = self.pending.get(target)
+            if previous is not None:
+                command = self._coalesce(previous, command)
+            if command is None:
+                del self.pending[target]
+                return None
+            self.pending[target] = command
+            self.condition.notify()
+            return command
+
+    def _coalesce(self, previous, command):
+        """
+        Merge a new command into the pending command for the same target.
+        :return: The merged command, or None if two relative adjustments cancel out.
+        """
+        if command.is_relative and (previous.is_relative or previous.is_absolute):
+            # Fold the adjustment into the pending one
+            total = previous.signed_value() + command.signed_value()
+            if previous.is_absolute:
+                # Absolute values cannot go below zero
+                merged = ControlCommand(command.mode, command.sub_mode, OP_SET,
+                                        max(0.0, round(total, 2)), previous.timestamp)
+            elif round(total, 2) == 0:
+                # No-op for the robot, nothing left to send
+                self.merged_count += 1
+                return None
+            else:
+                op = OP_ADD if total >= 0 else OP_SUB
+                merged = ControlCommand(command.mode, command.sub_mode, op,
+                                        round(abs(total), 2), previous.timestamp)
+            try:
+                parse_command(merged.to_code())
+            except ValueError as e:
+                print(f"Dropped command {command.to_code()}, merged result is invalid: {e}")
+                self.dropped_count += 1
+                return previous
+            self.merged_count += 1
+            return merged
+        # A newer absolute or non-adjustable command overrides the pending one
+        self.dropped_count += 1
+        return command
+
+    def dispatch(self, now=None):
+        """
+        Send every pending command whose target is outside its rate limit window.
+        :param now: The current monotonic time, defaults to time.monotonic().
+        :return: The number of seconds until the next pending command may be sent, or None if the queue is empty.
+        """
+        ready = []
+        with self.condition:
+            now = time.monotonic() if now is None else now
+            wait = None
+            for target in list(self.pending):
+                last = self.last_sent.get(target)
+                if last is None or now - last >= self.min_interval:
+                    ready.append(self.pending.pop(target))
+                    self.last_sent[target] = now
+                else:
+                    remaining = self.min_interval - (now - last)
+                    wait = remaining if wait is None else min(wait, remaining)
+        for command in ready:
+            self._send(command)
+        return wait
+
+    def _send(self, command):
+        """
+        Send one command; a failing sender must not stop the queue.
+        """
+        try:
+            self.sender(command)
+            self.sent_count += 1
+        except Exception as e:
+            self.failed_count += 1
+            print(f"Error sending command {command.to_code()}: {e}")
+
+    def start(self):
+        """
+        Start the background thread that dispatches pending commands.
+        """
+        if self.worker is not None:
+            return
+        self.running = True
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        """
+        Stop the background thread and send whatever is still pending, still respecting the per-target rate limit.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        wait = self.dispatch()
+        while wait is not None:
+            time.sleep(wait)
+            wait = self.dispatch()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+            wait = self.dispatch()
+            if wait is not None:
+                with self.condition:
+                    if self.running:
+                        self.condition.wait(wait)
+
+
+if __name__ == "__main__":
+    queue = CommandDispatchQueue(sender=lambda command: print(f"Send command: {command.to_code()}"))
+    # Missing levels round-trip through the -1 placeholder, trailing ones are dropped
+    for code in ["1--1-1-0.50", "2--1-3-0.05", "4", "1-2-2-15.00"]:
+        assert parse_command(code).to_code() == code, code
+    assert parse_command("1-3--1--1").to_code() == "1-3"
+
+    for code in ["1-3-2-0.05", "1-3-2-0.05", "1-3-3-0.02", "1-1-2-0.10", "1-1-1-0.50", "5", "1-2-2-0.05", "1-2-3-0.05"]:
+        pending = queue.put(code)
+        print(f"Queued {code} -> pending {pending.to_code() if pending else None}")
+    queue.dispatch()
+    queue.put("1-3-2-0.05")
+    print(f"Seconds until step height can be sent again: {queue.dispatch():.2f}")
+
+    # A decrease folded into a pending absolute command never goes below zero
+    queue.put("1-1-1-0.05")
+    merged = queue.put("1-1-3-0.10")
+    assert merged.to_code() == "1-1-1-0", merged
+    parse_command(merged.to_code())
+    queue.stop()
@@ -1,8 +1,18 @@
 from openai import OpenAI
+from PromptCompiler import PromptCompiler
 
 
 class LLMControlApi:
-    def __init__(self, api_key, base_url, filename="Prompt.txt"):
+    def __init__(self, api_key, base_url, filename="Prompt.txt", trace=None, compile_prompt=False, cache=None):
+        """
+        Initialize the LLM control API.
+        :param api_key: The API key of the large language model.
+        :param base_url: The base URL of the large language model.
+        :param filename: The path of the prompt txt file.
+        :param trace: Optional TraceWriter that records each request and response.
+        :param compile_prompt: Send only the minified rules relevant to each input instead of the whole prompt.
+        :param cache: Optional CommandCache that answers repeated-intent inputs without an LLM call.
+        """
         self.api_key = api_key
         self.base_url = base_url
         self.client = OpenAI(
@@ -10,6 +20,12 @@ class LLMControlApi:
             base_url=self.base_url
         )
         self.prompt = self.get_prompt_from_txt(filename)
+        self.model = "ep-20250227141841-6nlvh"
+        self.trace = trace
+        self.cache = cache
+        self.compiler = None
+        if compile_prompt and self.prompt is not None:
+            self.compiler = PromptCompiler(self.prompt)
 
     def get_prompt_from_txt(self, file_path):
         """
@@ -32,16 +48,33 @@ class LLMControlApi:
         if self.client is None or self.prompt is None:
             raise ValueError("You need to add the Baseurl, API key and get the prompt first to get the feedback.")
 
+        if self.cache is not None:
+            cached = self.cache.lookup(user_input)
+            if cached is not None:
+                if self.trace is not None:
+                    self.trace.record_llm_cached_response(cached)
+                return cached
+
+        prompt = self.prompt
+        if self.compiler is not None:
+            prompt = self.compiler.compile(user_input)
         messages = [
-            {"role": "system", "content": self.prompt},
+            {"role": "system", "content": prompt},
             {"role": "user", "content": user_input}
         ]
 
+        if self.trace is not None:
+            self.trace.record_llm_request(self.model, messages)
         completion = self.client.chat.completions.create(
-            model="ep-20250227141841-6nlvh",
+            model=self.model,
             messages=messages
         )
-        return completion.choices[0].message.content
+        content = completion.choices[0].message.content
+        if self.trace is not None:
+            self.trace.record_llm_response(content)
+        if self.cache is not None:
+            self.cache.store(user_input, content)
+        return content
 
 
 if __name__ == "__main__":
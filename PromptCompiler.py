@@ -0,0 +1,238 @@
+import math
+import re
+
+try:
+    import tiktoken  # Optional, only used for exact token counts
+except ImportError:
+    tiktoken = None
+
+
+HEADER_PATTERN = re.compile(r"^\*\*(.+?)\*\*$")
+ITEM_PATTERN = re.compile(r"^\d+\.\s*")
+CJK_PATTERN = re.compile(r"[一-鿿]+")
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+QUOTED_PATTERN = re.compile(r"[\"“](.+?)[\"”]")
+TOKEN_PATTERN = re.compile(r"[一-鿿]|[A-Za-z]+|\d+|\S")
+
+# Every rule of Prompt.txt (priority, special sentences, stunt/undefined output...) can apply to any input,
+# so by default all rules are kept and only the few-shot examples are selected per transcript.
+# Narrow these only after checking the encoder output against a labelled set of commands.
+DEFAULT_CORE_RULES = None  # Headings of the rules always included, None for all rules
+DEFAULT_TABLE_RULE = None  # Heading of the rule whose lines are selected row by row, e.g. "模式映射"
+
+
+def estimate_tokens(text):
+    """
+    Count the tokens of a text, exactly if tiktoken is installed, otherwise estimated
+    (one token per CJK character or punctuation mark, about four characters per word or number).
+    :param text: The text.
+    :return: The number of tokens.
+    """
+    if tiktoken is not None:
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    count = 0
+    for token in TOKEN_PATTERN.findall(text):
+        count += math.ceil(len(token) / 4) if token.isalnum() and not CJK_PATTERN.match(token) else 1
+    return count
+
+
+def minify_line(line):
+    """
+    Strip indentation, markdown and redundant whitespace from a prompt line.
+    """
+    line = line.strip().replace("**", "").replace("`", "")
+    line = re.sub(r"^-\s*", "-", line)
+    line = re.sub(r"\s*(→|：|，|（|）)\s*", r"\1", line)
+    return re.sub(r"\s+", " ", line)
+
+
+def bigrams(text):
+    """
+    Get the set of character bigrams of the CJK runs in a text.
+    """
+    grams = set()
+    for run in CJK_PATTERN.findall(text):
+        grams.update(run[i:i + 2] for i in range(len(run) - 1))
+    return grams
+
+
+class PromptSection:
+    __slots__ = ("header", "group", "text", "terms", "grams", "core", "kind")
+
+    def __init__(self, header, group, text, core=False, kind="rule", match_text=None):
+        """
+        One selectable piece of the prompt.
+
+        :param header: The prompt header the section belongs to, or None.
+        :param group: The rule heading line printed before the section, or None.
+        :param text: The minified text of the section.
+        :param core: Whether the section is always included.
+        :param kind: "rule", "table" or "example".
+        :param match_text: The text the keywords are taken from. Default is the section text.
+        """
+        self.header = header
+        self.group = group
+        self.text = text
+        self.core = core
+        self.kind = kind
+        match_text = text if match_text is None else match_text
+        terms = set(run for run in CJK_PATTERN.findall(match_text) if len(run) >= 2)
+        terms.update(word.lower() for word in WORD_PATTERN.findall(match_text))
+        for quoted in QUOTED_PATTERN.findall(match_text):
+            terms.update(term.strip() for term in quoted.split("/") if term.strip())
+        self.terms = terms
+        self.grams = bigrams(match_text)
+
+    def score(self, transcript, transcript_grams):
+        """
+        Score the relevance of the section to a transcript by keyword and bigram matches.
+        """
+        return sum(1 for term in self.terms if term in transcript) + len(self.grams & transcript_grams)
+
+
+class PromptCompiler:
+    def __init__(self, prompt, core_rules=DEFAULT_CORE_RULES, table_rule=DEFAULT_TABLE_RULE, max_examples=2):
+        """
+        Compile the prompt into a minified, indexed form so that each request only carries the relevant rules.
+
+        :param prompt: The prompt text, as read from Prompt.txt.
+        :param core_rules: Headings of the rules that are always included, None for all rules.
+        :param table_rule: Heading of the rule whose lines are selected row by row, None to keep it whole.
+        :param max_examples: The maximum number of few-shot examples per request.
+        """
+        self.prompt = prompt
+        self.core_rules = core_rules
+        self.table_rule = table_rule
+        self.max_examples = max_examples
+        self.sections = []
+        self.suffix = ""
+        self._parse(prompt)
+        # Everything up to the first selectable section is identical for every request
+        prefix = []
+        for section in self.sections:
+            if not section.core:
+                break
+            prefix.append(section)
+        self.prefix = "\n".join(self._render(prefix))
+        self.minified = "\n".join(self._render(self.sections) + [self.suffix])
+
+    def _parse(self, prompt):
+        header = None
+        item = None  # (group, heading line, sub lines)
+        pending_text = []
+
+        def flush_item():
+            if item is None:
+                return
+            group, head, subs = item
+            if self.table_rule is not None and self.table_rule in head:
+                self.sections.extend(PromptSection(group, head, sub, kind="table") for sub in subs)
+            else:
+                core = self.core_rules is None or any(rule in head for rule in self.core_rules)
+                self.sections.append(PromptSection(group, None, "\n".join([head] + subs), core=core))
+
+        for raw_line in prompt.splitlines():
+            line = minify_line(raw_line)
+            if not line:
+                continue
+            match = HEADER_PATTERN.match(raw_line.strip())
+            if match:
+                flush_item()
+                item = None
+                header = match.group(1).strip()
+                continue
+            if ITEM_PATTERN.match(line):
+                flush_item()
+                item = (header, line, [])
+            elif item is not None and line[0] in "-[":
+                item[2].append(line)
+            elif "→" in line:
+                flush_item()
+                item = None
+                example_input = line.split("→")[0]
+                self.sections.append(PromptSection(header, None, line, kind="example", match_text=example_input))
+            else:
+                flush_item()
+                item = None
+                pending_text.append(line)
+                if not self.sections:
+                    # Free text before the first rule introduces the prompt
+                    self.sections.append(PromptSection(None, None, line, core=True))
+                    pending_text.pop()
+        flush_item()
+        # Free text after the last rule (e.g. "请对当前指令进行编码：") closes the prompt
+        self.suffix = "\n".join(pending_text)
+
+    @staticmethod
+    def _render(sections):
+        lines = []
+        header = group = None
+        for section in sections:
+            if section.header is not None and section.header != header:
+                lines.append(section.header)
+                group = None
+            if section.group is not None and section.group != group:
+                lines.append(section.group)
+            header, group = section.header, section.group
+            lines.append(section.text)
+        return lines
+
+    def select(self, transcript):
+        """
+        Select the non-core sections relevant to a transcript.
+        :param transcript: The recognized text.
+        :return: The selected sections, in prompt order.
+        """
+        transcript = transcript.lower()
+        transcript_grams = bigrams(transcript)
+        scores = {id(section): section.score(transcript, transcript_grams)
+                  for section in self.sections if not section.core}
+        selected = set(key for key, section_score in scores.items() if section_score > 0)
+
+        # Without a matching row the model still needs the whole mode table
+        table = [section for section in self.sections if section.kind == "table"]
+        if table and not any(id(section) in selected for section in table):
+            selected.update(id(section) for section in table)
+
+        examples = [section for section in self.sections if section.kind == "example"]
+        examples.sort(key=lambda section: scores[id(section)], reverse=True)
+        for section in examples[self.max_examples:]:
+            selected.discard(id(section))
+
+        return [section for section in self.sections if id(section) in selected]
+
+    def compile(self, transcript):
+        """
+        Build the system prompt for one transcript. Sections keep their original order and headers;
+        the leading core sections never change, so provider-side prefix caching can hit.
+        :param transcript: The recognized text.
+        :return: The compiled prompt.
+        """
+        selected = set(id(section) for section in self.select(transcript))
+        sections = [section for section in self.sections if section.core or id(section) in selected]
+        return "\n".join(self._render(sections) + [self.suffix])
+
+    def report(self, transcript=None):
+        """
+        Report the token counts of the original, minified and compiled prompts.
+        :param transcript: Optional transcript to report the compiled prompt for.
+        :return: A dict of token counts.
+        """
+        report = {
+            "original_tokens": estimate_tokens(self.prompt),
+            "minified_tokens": estimate_tokens(self.minified),
+            "prefix_tokens": estimate_tokens(self.prefix),
+            "sections": len(self.sections),
+        }
+        if transcript is not None:
+            report["compiled_tokens"] = estimate_tokens(self.compile(transcript))
+        return report
+
+
+if __name__ == "__main__":
+    with open("Prompt.txt", "r", encoding="utf-8") as file:
+        compiler = PromptCompiler(file.read())
+
+    for user_input in ["步高调到15厘米", "能不能后空翻", "用轻快步态移动", "像兔子一样跳一下"]:
+        print(f"---- {user_input} {compiler.report(user_input)}")
+        print(compiler.compile(user_input))
@@ -30,19 +30,24 @@ class AudioType(Enum):
 
 
 class SpeechRecognizer:
-    def __init__(self, appid, token, cluster="volcengine_input_common"):
+    def __init__(self, appid, token, cluster="volcengine_input_common", trace=None, stage_pool=None):
         """
         Initialize the speech recognizer.
 
         :param appid: The appid of the project.
         :param token: The token of the project.
         :param cluster: The cluster to request.
+        :param trace: Optional TraceWriter that records the audio and the ASR frames of each session.
+        :param stage_pool: Optional CpuStagePool that compresses the audio chunks in worker processes.
         """
         self.appid = appid
         self.token = token
         self.cluster = cluster
         self.ws_url = "wss://openspeech.bytedance.com/api/v2/asr"
         self.auth_method = "token"
+        self.trace = trace
+        self.connect = websockets.connect  # Replaced by TraceReplayer during replay
+        self.stage_pool = stage_pool
 
         # Default parameter settings
         self.success_code = 1000
@@ -90,7 +95,10 @@ class SpeechRecognizer:
             bits=self.bits,
             channel=self.channel,
             codec=self.codec,
-            mp3_seg_size=self.mp3_seg_size
+            mp3_seg_size=self.mp3_seg_size,
+            trace=self.trace,
+            connect=self.connect,
+            stage_pool=self.stage_pool
         )
 
         return await client.execute()
@@ -152,6 +160,9 @@ class AsrWsClient:
         self.secret = kwargs.get("secret", "access_secret")
         self.auth_method = kwargs.get("auth_method", "token")
         self.mp3_seg_size = int(kwargs.get("mp3_seg_size", 10000))
+        self.trace = kwargs.get("trace", None)
+        self.connect = kwargs.get("connect", websockets.connect)
+        self.stage_pool = kwargs.get("stage_pool", None)
 
     def construct_request(self, reqid):
         """
@@ -250,21 +261,30 @@ class AsrWsClient:
         full_client_request = bytearray(generate_full_default_header())
         full_client_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
         full_client_request.extend(payload_bytes)  # payload
+        compressed_chunks = None
+        if self.stage_pool is not None:
+            # Compress all chunks up front in the worker processes
+            compressed_chunks = self.stage_pool.compress_chunks(wav_data, segment_size)
         header = None
         if self.auth_method == "token":
             header = self.token_auth()
         elif self.auth_method == "signature":
             header = self.signature_auth(full_client_request)
-        async with websockets.connect(self.ws_url, extra_headers=header, max_size=1000000000) as ws:
+        async with self.connect(self.ws_url, extra_headers=header, max_size=1000000000) as ws:
             # Send the full client request
             await ws.send(full_client_request)
             res = await ws.recv()
+            if self.trace is not None:
+                self.trace.record_asr_frame(res)
             result = parse_response(res)
             if 'payload_msg' in result and result['payload_msg']['code'] != self.success_code:
                 return result
             for seq, (chunk, last) in enumerate(AsrWsClient.slice_data(wav_data, segment_size), 1):
                 # If no compression, comment this line
-                payload_bytes = gzip.compress(chunk)
+                if compressed_chunks is not None:
+                    payload_bytes = compressed_chunks[seq - 1]
+                else:
+                    payload_bytes = gzip.compress(chunk)
                 audio_only_request = bytearray(generate_audio_default_header())
                 if last:
                     audio_only_request = bytearray(generate_last_audio_default_header())
@@ -273,6 +293,8 @@ class AsrWsClient:
                 # Send the audio-only client request
                 await ws.send(audio_only_request)
                 res = await ws.recv()
+                if self.trace is not None:
+                    self.trace.record_asr_frame(res)
                 result = parse_response(res)
                 if 'payload_msg' in result and result['payload_msg']['code'] != self.success_code:
                     return result
@@ -286,6 +308,8 @@ class AsrWsClient:
         with open(self.audio_path, mode="rb") as _f:
             data = _f.read()
         audio_data = bytes(data)
+        if self.trace is not None:
+            self.trace.record_audio(audio_data, self.format)
         if self.format == "mp3":
             segment_size = self.mp3_seg_size
             return await self.segment_data_processor(audio_data, segment_size)
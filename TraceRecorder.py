@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import SimpleNamespace
+
+
+# File layout: header, then records of (kind, session id, timestamp, payload size) + payload
+TRACE_MAGIC = b"VTRC"
+TRACE_VERSION = 1
+FILE_HEADER = struct.Struct(">4sB3x")
+RECORD_HEADER = struct.Struct(">BIdI")
+
+# Record kinds
+SESSION_START = 1
+AUDIO = 2
+ASR_FRAME = 3
+LLM_REQUEST = 4
+LLM_RESPONSE = 5
+SESSION_END = 6
+LLM_CACHED_RESPONSE = 7  # Answered by the command cache without an LLM call
+
+TraceRecord = namedtuple("TraceRecord", ["kind", "session", "timestamp", "payload"])
+
+
+class TraceWriter:
+    def __init__(self, file_path):
+        """
+        Open an append-only session trace file, creating it if needed.
+        Records are tagged with the session started on the calling thread.
+
+        :param file_path: The path of the trace file.
+        """
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.next_session = 1
+        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            with TraceReader(file_path) as reader:
+                self.next_session = max((record.session for record in reader), default=0) + 1
+                valid_size = reader.valid_size()
+            # Cut off a truncated trailing record (e.g. after a crash) so new records stay readable
+            if valid_size < os.path.getsize(file_path):
+                os.truncate(file_path, valid_size)
+            self.file = open(file_path, "ab")
+        else:
+            self.file = open(file_path, "ab")
+            self.file.write(FILE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+            self.file.flush()
+
+    def begin_session(self, **meta):
+        """
+        Start a new session on the calling thread.
+        :param meta: Extra JSON-serializable information stored with the session start.
+        :return: The session ID.
+        """
+        with self.lock:
+            session = self.next_session
+            self.next_session += 1
+        self.local.session = session
+        self._write(SESSION_START, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        return session
+
+    def end_session(self):
+        """
+        End the session of the calling thread.
+        """
+        self._write(SESSION_END, b"")
+        self.local.session = 0
+
+    def record_audio(self, data, audio_format="wav"):
+        """
+        Record the audio file sent for recognition.
+        :param data: The audio file data.
+        :param audio_format: The audio format, "wav" or "mp3".
+        """
+        audio_format = audio_format.encode("ascii")
+        self._write(AUDIO, bytes([len(audio_format)]) + audio_format + data)
+
+    def record_asr_frame(self, frame):
+        """
+        Record a raw ASR server frame, as handed to parse_response.
+        :param frame: The frame data.
+        """
+        self._write(ASR_FRAME, bytes(frame))
+
+    def record_llm_request(self, model, messages):
+        """
+        Record an LLM request.
+        :param model: The model name.
+        :param messages: The message list.
+        """
+        payload = {"model": model, "messages": messages}
+        self._write(LLM_REQUEST, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def record_llm_response(self, content):
+        """
+        Record an LLM response.
+        :param content: The model feedback result.
+        """
+        self._write(LLM_RESPONSE, (content or "").encode("utf-8"))
+
+    def record_llm_cached_response(self, content):
+        """
+        Record a response served by the command cache instead of the LLM.
+        :param content: The cached command string.
+        """
+        self._write(LLM_CACHED_RESPONSE, content.encode("utf-8"))
+
+    def _write(self, kind, payload):
+        session = getattr(self.local, "session", 0)
+        header = RECORD_HEADER.pack(kind, session, time.time(), len(payload))
+        with self.lock:
+            self.file.write(header)
+            self.file.write(payload)
+            self.file.flush()
+
+    def close(self):
+        """
+        Close the trace file.
+        """
+        with self.lock:
+            self.file.close()
+
+
+class TraceReader:
+    def __init__(self, file_path):
+        """
+        Open a session trace file for reading through mmap.
+        :param file_path: The path of the trace file.
+        """
+        self.file_path = file_path
+        self.file = open(file_path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < FILE_HEADER.size:
+            raise ValueError(f"Not a trace file: {file_path}")
+        magic, version = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace file: {file_path}")
+
+    def __iter__(self):
+        """
+        Iterate over the records. A truncated trailing record (e.g. after a crash) is ignored.
+        """
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        while offset + RECORD_HEADER.size <= end:
+            kind, session, timestamp, size = RECORD_HEADER.unpack_from(self.map, offset)
+            offset += RECORD_HEADER.size
+            if offset + size > end:
+                break
+            yield TraceRecord(kind, session, timestamp, self.map[offset:offset + size])
+            offset += size
+
+    def valid_size(self):
+        """
+        Get the size of the file up to the end of the last complete record.
+        """
+        offset = FILE_HEADER.size
+        end = len(self.map)
+        while offset + RECORD_HEADER.size <= end:
+            size = RECORD_HEADER.unpack_from(self.map, offset)[3]
+            if offset + RECORD_HEADER.size + size > end:
+                break
+            offset += RECORD_HEADER.size + size
+        return offset
+
+    def sessions(self):
+        """
+        Group the records by session.
+        :return: An ordered dict of session ID to the list of its records.
+        """
+        sessions = OrderedDict()
+        for record in self:
+            if record.session:
+                sessions.setdefault(record.session, []).append(record)
+        return sessions
+
+    def close(self):
+        """
+        Close the trace file.
+        """
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayConnection:
+    def __init__(self, replayer):
+        """
+        A stand-in for the ASR websocket connection that answers with recorded frames.
+        """
+        self.replayer = replayer
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return False
+
+    async def send(self, data):
+        pass
+
+    async def recv(self):
+        if not self.replayer.asr_frames:
+            raise EOFError("No more recorded ASR frames in the session")
+        timestamp, frame = self.replayer.asr_frames.pop(0)
+        delay = self.replayer.delay_until(timestamp)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return frame
+
+
+class TraceReplayer:
+    def __init__(self, records, realtime=True):
+        """
+        Replay one recorded session.
+
+        :param records: The records of the session, as returned by TraceReader.sessions().
+        :param realtime: Deliver the recorded responses with the original timing if True, as fast as possible otherwise.
+        """
+        self.realtime = realtime
+        self.start_time = records[0].timestamp if records else 0.0
+        self.audio = None
+        self.audio_format = "wav"
+        self.asr_frames = []
+        self.llm_responses = []
+        for record in records:
+            if record.kind == AUDIO and self.audio is None:
+                size = record.payload[0]
+                self.audio_format = record.payload[1:1 + size].decode("ascii")
+                self.audio = record.payload[1 + size:]
+            elif record.kind == ASR_FRAME:
+                self.asr_frames.append((record.timestamp, record.payload))
+            elif record.kind in (LLM_RESPONSE, LLM_CACHED_RESPONSE):
+                self.llm_responses.append((record.timestamp, record.payload.decode("utf-8")))
+        self.replay_start = None
+        self.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        )
+
+    def delay_until(self, timestamp):
+        """
+        Get the number of seconds to wait so that an event happens at its recorded offset.
+        """
+        if not self.realtime or self.replay_start is None:
+            return 0.0
+        return (timestamp - self.start_time) - (time.monotonic() - self.replay_start)
+
+    def connect(self, ws_url, **kwargs):
+        """
+        Replacement for websockets.connect used by AsrWsClient.
+        """
+        return ReplayConnection(self)
+
+    def _create_completion(self, model, messages, **kwargs):
+        if not self.llm_responses:
+            raise EOFError("No more recorded LLM responses in the session")
+        timestamp, content = self.llm_responses.pop(0)
+        delay = self.delay_until(timestamp)
+        if delay > 0:
+            time.sleep(delay)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def replay(self, recognizer, llm_api):
+        """
+        Drive the recognizer and the LLM API through the recorded session.
+
+        :param recognizer: A SpeechRecognizer instance.
+        :param llm_api: An LLMControlApi instance.
+        :return: A dict with the recognized text, the model feedback and the time spent in each stage.
+        """
+        if self.audio is None:
+            raise ValueError("The session has no recorded audio")
+        with tempfile.NamedTemporaryFile(suffix="." + self.audio_format, delete=False) as temp_file:
+            temp_file.write(self.audio)
+            temp_name = temp_file.name
+        # Swap in the recorded responses and keep the replay out of any live trace and command cache
+        saved = recognizer.connect, recognizer.trace, llm_api.client, llm_api.trace, llm_api.cache
+        recognizer.connect, recognizer.trace = self.connect, None
+        llm_api.client, llm_api.trace, llm_api.cache = self.client, None, None
+        try:
+            self.replay_start = time.monotonic()
+            recognized_text = recognizer.recognize_file(temp_name)
+            asr_seconds = time.monotonic() - self.replay_start
+            model_feedback = None
+            if recognized_text:
+                model_feedback = llm_api.get_model_feedback(recognized_text)
+            return {
+                "text": recognized_text,
+                "feedback": model_feedback,
+                "asr_seconds": asr_seconds,
+                "llm_seconds": time.monotonic() - self.replay_start - asr_seconds
+            }
+        finally:
+            recognizer.connect, recognizer.trace, llm_api.client, llm_api.trace, llm_api.cache = saved
+            os.remove(temp_name)
+
+
+if __name__ == "__main__":
+    from SpeechRecognizer import SpeechRecognizer
+    from LLMControlApi import LLMControlApi
+
+    parser = argparse.ArgumentParser(description="Replay recorded voice interaction sessions.")
+    parser.add_argument("trace", help="The trace file to replay.")
+    parser.add_argument("--session", type=int, help="Replay only this session ID.")
+    parser.add_argument("--fast", action="store_true", help="Replay as fast as possible instead of with the original timing.")
+    args = parser.parse_args()
+
+    # Replay never reaches the real services, so placeholder credentials are enough
+    recognizer = SpeechRecognizer("replay", "replay")
+    llm_api = LLMControlApi("replay", "http://localhost")
+
+    with TraceReader(args.trace) as reader:
+        for session, records in reader.sessions().items():
+            if args.session is not None and session != args.session:
+                continue
+            try:
+                result = TraceReplayer(records, realtime=not args.fast).replay(recognizer, llm_api)
+            except Exception as e:
+                # Failed sessions are the interesting ones, keep replaying the rest
+                print(f"Session {session}: replay failed: {e}")
+                continue
+            print(f"Session {session}: {result['text']!r} -> {result['feedback']!r} "
+                  f"(ASR {result['asr_seconds']:.3f}s, LLM {result['llm_seconds']:.3f}s)")
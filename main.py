@@ -7,6 +7,10 @@ import tempfile
 import os
 from SpeechRecognizer import SpeechRecognizer
 from LLMControlApi import LLMControlApi
+from CommandDispatcher import CommandDispatchQueue, parse_command
+from TraceRecorder import TraceWriter
+from AudioStages import CpuStagePool
+from CommandCache import CommandCache
 
 
 # AudioRecorder class is used to record audio from the microphone
@@ -103,35 +107,67 @@ class AudioRecorder:
 
 
 # Process the recorded audio file, recognize the speech, and get feedback from the LLM
-def process_recording(recognizer, llm_api):
+def process_recording(recognizer, llm_api, dispatch_queue=None, trace=None, stage_pool=None):
     """
     Process the recorded audio file.
     Copy the temporary audio file, recognize the speech in it, and get feedback from the LLM.
+    If a dispatch queue is given, the feedback is parsed and queued as a command.
+    If a trace writer is given, the processing is recorded as one session.
+    If a stage pool is given, leading and trailing silence is trimmed in its worker processes.
     Finally, delete the temporary file.
     """
+    temp_name = None
+    if trace is not None:
+        trace.begin_session()
     try:
         with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
             temp_name = temp_file.name
-        shutil.copyfile('temp.wav', temp_name)
+        if stage_pool is not None:
+            with open('temp.wav', 'rb') as f:
+                prepared = stage_pool.prepare_wav(f.read())
+            with open(temp_name, 'wb') as f:
+                f.write(prepared)
+        else:
+            shutil.copyfile('temp.wav', temp_name)
         recognized_text = recognizer.recognize_file(temp_name)
         if recognized_text:
             model_feedback = llm_api.get_model_feedback(recognized_text)
             print(f"Large model feedback result: {model_feedback}")
+            if dispatch_queue is not None:
+                dispatch_queue.put(parse_command(model_feedback))
     except Exception as e:
         print(f"Error processing recording: {e}")
     finally:
-        if os.path.exists(temp_name):
+        if temp_name and os.path.exists(temp_name):
             os.remove(temp_name)
+        if trace is not None:
+            trace.end_session()
 
 
 if __name__ == "__main__":
+    # Set a file path (e.g. "sessions.trace") to record every session for offline replay
+    trace_path = None
+    trace = TraceWriter(trace_path) if trace_path else None
+
+    # Set to True to run the CPU-heavy audio stages in a process pool (Python 3.8 or later)
+    use_stage_pool = False
+    stage_pool = CpuStagePool() if use_stage_pool else None
+
     voice_appid = "xxx"
     voice_token = "xxx"
-    recognizer = SpeechRecognizer(voice_appid, voice_token)
+    recognizer = SpeechRecognizer(voice_appid, voice_token, trace=trace, stage_pool=stage_pool)
 
     LLM_api_key = "xxx"
     LLM_base_url = "https://ark.cn-beijing.volces.com/api/v3"
-    llm_api = LLMControlApi(LLM_api_key, LLM_base_url)
+    # Set to True to answer repeated-intent commands from the cache without an LLM call,
+    # only after checking the cached results against a labelled set of commands
+    use_command_cache = False
+    command_cache = CommandCache() if use_command_cache else None
+    llm_api = LLMControlApi(LLM_api_key, LLM_base_url, trace=trace, compile_prompt=False, cache=command_cache)
+
+    # Replace the sender with the robot control bus client
+    dispatch_queue = CommandDispatchQueue(sender=lambda command: print(f"Dispatch command: {command.to_code()}"))
+    dispatch_queue.start()
 
     recorder = AudioRecorder()
 
@@ -139,7 +175,7 @@ if __name__ == "__main__":
         recorder.recording_complete_event.wait()
         threading.Thread(
             target=process_recording,
-            args=(recognizer, llm_api)
+            args=(recognizer, llm_api, dispatch_queue, trace, stage_pool)
         ).start()
         recorder.recording_complete_event.clear()
         print("Recording on standby ------")
\ No newline at end of file